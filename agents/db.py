@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, MetaData, Table, Column, String, Float, Date
+from config import DB_CONFIG
+
+# Connection pool sizing; at most POOL_SIZE + MAX_OVERFLOW connections are open at once
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
+# Shared engine so every agent draws from one connection pool
+ENGINE = create_engine(
+    f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@"
+    f"{DB_CONFIG['host']}/{DB_CONFIG['database']}",
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    future=True
+)
+
+METADATA = MetaData()
+
+# Core table for dialect-aware bulk upserts into stockprice
+STOCKPRICE = Table(
+    'stockprice',
+    METADATA,
+    Column('stockSymbol', String(50), primary_key=True),
+    Column('price', Float),
+    Column('priceDate', Date, primary_key=True),
+    Column('source', String(20))
+)
@@ -1,29 +1,38 @@
+import functools
 import logging
+import threading
 from config import LOG_CONFIG, LOG_LEVELS
 
+# Shared formatter for all agent loggers
+_FORMATTER = logging.Formatter(
+    fmt=LOG_CONFIG['format'],
+    datefmt=LOG_CONFIG['date_format']
+)
+
+# Held around multi-line console output so concurrent owners don't interleave
+OUTPUT_LOCK = threading.Lock()
+
+# Level resolved once from config
+_LEVEL = LOG_LEVELS.get(LOG_CONFIG['level'], logging.INFO)
+
+
+@functools.lru_cache(maxsize=None)
 def setup_logger(name):
     """Setup and return a logger instance"""
     # Create logger
     logger = logging.getLogger(name)
     
     # Set level from config
-    logger.setLevel(LOG_LEVELS.get(LOG_CONFIG['level'], logging.INFO))
+    logger.setLevel(_LEVEL)
     
-    # Create console handler and set level
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logger.level)
-    
-    # Create formatter
-    formatter = logging.Formatter(
-        fmt=LOG_CONFIG['format'],
-        datefmt=LOG_CONFIG['date_format']
-    )
-    
-    # Add formatter to handler
-    console_handler.setFormatter(formatter)
-    
-    # Add handler to logger if it doesn't already have handlers
+    # Add console handler if logger doesn't already have handlers
     if not logger.handlers:
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logger.level)
+        console_handler.setFormatter(_FORMATTER)
         logger.addHandler(console_handler)
     
-    return logger 
\ No newline at end of file
+    # Avoid double emission once a root handler is attached
+    logger.propagate = False
+    
+    return logger
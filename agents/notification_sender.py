@@ -1,59 +1,131 @@
 import smtplib
+import weakref
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+import jinja2
 from config import EMAIL_CONFIG, FEATURE_FLAGS
+from agents.logger import setup_logger
+
+# Email body template, compiled once at import
+_EMAIL_TEMPLATE = jinja2.Environment(autoescape=True).from_string("""
+            <html>
+            <body>
+                <h2>Portfolio Performance Summary</h2>
+                <p>Average Performance: {{ '%.2f'|format(avg_performance) }}%</p>
+                
+                <h3>Performance Details:</h3>
+                {{ table|safe }}
+                <p><small>Generated on {{ generated_on }}</small></p>
+            </body>
+            </html>
+""")
+
+# Performance columns shown in the email, mapped to their table headers
+_EMAIL_COLUMNS = {
+    'stockSymbol': 'Stock',
+    'owner': 'Owner',
+    'portfolioName': 'Portfolio',
+    'purchasePrice': 'Purchase Price',
+    'price': 'Current Price',
+    'performance': 'Performance'
+}
+
+_EMAIL_FORMATTERS = {
+    'Purchase Price': '₹{:,.2f}'.format,
+    'Current Price': '₹{:,.2f}'.format,
+    'Performance': '{:.2f}%'.format
+}
+
+
+def _close_smtp(state):
+    """Close the SMTP connection held in state, if any"""
+    server = state['smtp']
+    if server is None:
+        return
+    state['smtp'] = None
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
 
 
 class NotificationSender:
     def __init__(self):
         self.config = EMAIL_CONFIG
-        print("\n📧 Initializing NotificationSender...")
-        print(f"Email notifications enabled: {FEATURE_FLAGS['enable_email_notifications']}")
-        print(f"SMTP Server: {self.config['smtp_server']}")
-        print(f"From Email: {self.config['sender_email']}")
-        print(f"To Email: {self.config['recipient_email']}")
+        self.logger = setup_logger(__name__)
+        # Connection lives in a holder so the finalizer never references self
+        self._state = {'smtp': None}
+        weakref.finalize(self, _close_smtp, self._state)
+        self.logger.debug(
+            f"NotificationSender initialized (enabled: {FEATURE_FLAGS['enable_email_notifications']}, "
+            f"server: {self.config['smtp_server']}, from: {self.config['sender_email']}, "
+            f"to: {self.config['recipient_email']})")
 
     def send_email_notification(self, performance_data):
         """Send email notification about portfolio performance"""
-        print("\n📧 Attempting to send email notification...")
-        
+        self.logger.debug("Attempting to send email notification")
+
         if not FEATURE_FLAGS['enable_email_notifications']:
-            print("📧 Email notifications are disabled in FEATURE_FLAGS")
+            self.logger.debug("Email notifications are disabled in FEATURE_FLAGS")
             return
 
         if performance_data is None or performance_data.empty:
-            print("⚠️ No performance data to send")
+            self.logger.warning("No performance data to send")
             return
 
         try:
-            print("Creating email message...")
+            self.logger.debug("Creating email message")
             msg = self._create_email_message(performance_data)
 
-            print(f"Connecting to SMTP server: {self.config['smtp_server']}:{self.config['smtp_port']}")
-            with smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port']) as server:
-                print("Starting TLS...")
-                server.starttls()
-                
-                print("Attempting login...")
-                if not self.config['sender_password']:
-                    print("❌ Error: Email password is not set in configuration")
-                    return
-                    
-                server.login(self.config['sender_email'], self.config['sender_password'])
-                
-                print("Sending message...")
-                server.send_message(msg)
-                print("\n✉️ Performance notification sent successfully")
+            server = self._get_smtp()
+            if server is None:
+                return
+
+            self.logger.debug("Sending message")
+            server.send_message(msg)
+            self.logger.info("Performance notification sent successfully")
 
         except smtplib.SMTPAuthenticationError as e:
-            print(f"\n❌ SMTP Authentication Error:")
-            print(f"   Please check your email and app password")
-            print(f"   Error: {str(e)}")
+            self.logger.error(
+                f"SMTP authentication error, please check your email and app password: {str(e)}")
         except Exception as e:
-            print(f"\n❌ Error sending notification:")
-            print(f"   Type: {type(e).__name__}")
-            print(f"   Error: {str(e)}")
+            self.logger.error(f"Error sending notification ({type(e).__name__}): {str(e)}")
+
+    def _get_smtp(self):
+        """Return a live SMTP connection, reconnecting only when the cached one is dead"""
+        if self._state['smtp'] is not None:
+            try:
+                if self._state['smtp'].noop()[0] == 250:
+                    return self._state['smtp']
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close()
+
+        self.logger.debug(
+            f"Connecting to SMTP server: {self.config['smtp_server']}:{self.config['smtp_port']}")
+        server = smtplib.SMTP(self.config['smtp_server'], self.config['smtp_port'])
+        try:
+            self.logger.debug("Starting TLS")
+            server.starttls()
+
+            self.logger.debug("Attempting login")
+            if not self.config['sender_password']:
+                self.logger.error("Email password is not set in configuration")
+                server.close()
+                return None
+
+            server.login(self.config['sender_email'], self.config['sender_password'])
+        except Exception:
+            server.close()
+            raise
+
+        self._state['smtp'] = server
+        return server
+
+    def _close(self):
+        """Close the cached SMTP connection"""
+        _close_smtp(self._state)
 
     def _create_email_message(self, performance_data):
         """Create formatted email message"""
@@ -62,7 +134,7 @@ class NotificationSender:
         msg['To'] = self.config['recipient_email']
         msg['Subject'] = f"Portfolio Performance Update - {datetime.now().strftime('%Y-%m-%d')}"
 
-        print(f"Creating email body with {len(performance_data)} records...")
+        self.logger.debug(f"Creating email body with {len(performance_data)} records")
         email_body = self._format_email_body(performance_data)
         msg.attach(MIMEText(email_body, 'html'))
 
@@ -72,54 +144,17 @@ class NotificationSender:
         """Format the email body with performance data"""
         try:
             avg_performance = performance_data['performance'].mean()
-            print(f"Average performance calculated: {avg_performance:.2f}%")
-            
-            return """
-            <html>
-            <body>
-                <h2>Portfolio Performance Summary</h2>
-                <p>Average Performance: {:.2f}%</p>
-                
-                <h3>Performance Details:</h3>
-                <table border="1">
-                    <tr>
-                        <th>Stock</th>
-                        <th>Owner</th>
-                        <th>Portfolio</th>
-                        <th>Purchase Price</th>
-                        <th>Current Price</th>
-                        <th>Performance</th>
-                    </tr>
-                    {}
-                </table>
-                <p><small>Generated on {}</small></p>
-            </body>
-            </html>
-            """.format(
-                avg_performance,
-                self._format_table_rows(performance_data),
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            )
-        except Exception as e:
-            print(f"❌ Error formatting email body: {str(e)}")
-            raise
+            self.logger.debug(f"Average performance calculated: {avg_performance:.2f}%")
 
-    def _format_table_rows(self, performance_data):
-        """Format table rows for email"""
-        try:
-            rows = ""
-            for _, row in performance_data.iterrows():
-                rows += f"""
-                    <tr>
-                        <td>{row['stockSymbol']}</td>
-                        <td>{row['owner']}</td>
-                        <td>{row['portfolioName']}</td>
-                        <td>₹{row['purchasePrice']:,.2f}</td>
-                        <td>₹{row['price']:,.2f}</td>
-                        <td>{row['performance']:.2f}%</td>
-                    </tr>
-                """
-            return rows
+            table = performance_data[list(_EMAIL_COLUMNS)].rename(
+                columns=_EMAIL_COLUMNS
+            ).to_html(index=False, border=1, formatters=_EMAIL_FORMATTERS)
+
+            return _EMAIL_TEMPLATE.render(
+                avg_performance=avg_performance,
+                table=table,
+                generated_on=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            )
         except Exception as e:
-            print(f"❌ Error formatting table rows: {str(e)}")
+            self.logger.error(f"Error formatting email body: {str(e)}")
             raise
@@ -1,49 +1,55 @@
+import sys
+import numpy as np
 import pandas as pd
-from datetime import datetime, date
+from datetime import date
 from agents.portfolio_fetcher import PortfolioFetcher
 from agents.price_fetcher import PriceFetcher
-from agents.logger import setup_logger
+from agents.logger import setup_logger, OUTPUT_LOCK
+
+
+def _as_num(series):
+    """Return series as numeric, skipping the conversion when already numeric"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    return pd.to_numeric(series, errors='coerce')
 
 
 class PerformanceCalculator:
-    def __init__(self):
-        self.portfolio_fetcher = PortfolioFetcher()
-        self.price_fetcher = PriceFetcher()
+    def __init__(self, portfolio_fetcher=None, price_fetcher=None):
+        self.portfolio_fetcher = portfolio_fetcher or PortfolioFetcher()
+        self.price_fetcher = price_fetcher or PriceFetcher()
         self.logger = setup_logger(__name__)
 
-    def calculate_performance_for_owner(self, owner):
-        """Calculate performance for a specific owner"""
+    def calculate_performance_for_owner(self, owner, prices_df=None):
+        """Calculate performance for a specific owner, optionally from prefetched prices"""
         try:
             self.logger.info(f"Calculating performance for owner: {owner}")
 
             # Fetch required data
-            portfolio_data, prices_df = self._fetch_data(owner)
+            portfolio_data, prices_df = self._fetch_data(owner, prices_df)
             if portfolio_data is None or prices_df is None:
                 return None
 
-            # Calculate performance
-            performance_data = self._calculate_performance(
-                portfolio_data, prices_df)
-            if performance_data is not None:
-                self._print_performance_summary(performance_data)
-
-            return performance_data
+            return self.calculate_performance(portfolio_data, prices_df)
 
         except Exception as e:
             self.logger.error(f"Error calculating performance: {str(e)}")
             return None
 
-    def _fetch_data(self, owner):
-        """Fetch required portfolio and price data"""
-        try:
-            # Get portfolio data
-            portfolio_data = self.portfolio_fetcher.get_portfolio_data()
-            if portfolio_data.empty:
-                self.logger.warning("No portfolio data found")
-                return None, None
+    def calculate_performance(self, portfolio_data, prices_df):
+        """Calculate performance for already fetched portfolio and price data"""
+        performance_data = self._calculate_performance(portfolio_data, prices_df)
+        if performance_data is not None:
+            with OUTPUT_LOCK:
+                self._print_performance_summary(performance_data)
 
-            # Filter for owner
-            portfolio_data = portfolio_data[portfolio_data['owner'] == owner]
+        return performance_data
+
+    def _fetch_data(self, owner, prices_df=None):
+        """Fetch required portfolio data, and price data unless already supplied"""
+        try:
+            # Get portfolio data for owner
+            portfolio_data = self.portfolio_fetcher.get_portfolio_data(owner)
             if portfolio_data.empty:
                 self.logger.warning(
                     f"No portfolio data found for owner: {owner}")
@@ -51,19 +57,17 @@ class PerformanceCalculator:
 
             # Get current prices
             symbols = portfolio_data['stockSymbol'].unique()
-            self.logger.debug(f"Fetching prices for symbols: {symbols}")
-            prices = self.price_fetcher.fetch_prices(symbols)
-
-            if not prices:
+            if prices_df is None:
+                self.logger.debug(f"Fetching prices for symbols: {symbols}")
+                prices_df = self.price_fetcher.fetch_prices_df(symbols)
+            else:
+                # Supplied prices are shared with other agents; work on our own copy
+                prices_df = prices_df.copy()
+
+            if prices_df.empty:
                 self.logger.warning("No price data available")
                 return None, None
 
-            # Convert prices dictionary to DataFrame
-            prices_df = pd.DataFrame([
-                {'stockSymbol': symbol, 'price': data['price']}
-                for symbol, data in prices.items()
-            ])
-
             return portfolio_data, prices_df
 
         except Exception as e:
@@ -74,14 +78,13 @@ class PerformanceCalculator:
         """Calculate performance metrics"""
         try:
             # Convert numeric columns
-            portfolio_data['purchasePrice'] = pd.to_numeric(
-                portfolio_data['purchasePrice'], errors='coerce')
-            portfolio_data['purchaseQty'] = pd.to_numeric(
-                portfolio_data['purchaseQty'], errors='coerce')
-            portfolio_data['additionalQty'] = pd.to_numeric(
-                portfolio_data['additionalQty'], errors='coerce').fillna(0)
-            prices_df['price'] = pd.to_numeric(
-                prices_df['price'], errors='coerce')
+            portfolio_data['purchasePrice'] = _as_num(portfolio_data['purchasePrice'])
+            prices_df['price'] = _as_num(prices_df['price'])
+
+            # Share the categorical join key so the merge hashes integer codes
+            portfolio_data['stockSymbol'] = portfolio_data['stockSymbol'].astype('category')
+            prices_df['stockSymbol'] = prices_df['stockSymbol'].astype(
+                portfolio_data['stockSymbol'].dtype)
 
             # Merge portfolio with latest prices
             performance_data = pd.merge(
@@ -91,17 +94,25 @@ class PerformanceCalculator:
                 how='left'
             )
 
-            # Calculate performance
-            mask = (performance_data['price'].notna() &
-                    performance_data['purchasePrice'].notna())
+            # Age of each price in days (only present when prices carry a date)
+            if 'priceDate' in performance_data:
+                price_dates = pd.to_datetime(
+                    performance_data['priceDate'], errors='coerce')
+                performance_data['price_age_days'] = (
+                    pd.Timestamp(date.today()) - price_dates.dt.normalize()
+                ).dt.days
+                performance_data['priceDate'] = price_dates.dt.date
 
-            performance_data['performance'] = None
-            if mask.any():
-                performance_data.loc[mask, 'performance'] = (
-                    (performance_data.loc[mask, 'price'] -
-                     performance_data.loc[mask, 'purchasePrice']) /
-                    performance_data.loc[mask, 'purchasePrice'] * 100
-                ).round(2)
+            # Calculate performance
+            purchase_price = performance_data['purchasePrice'].to_numpy(dtype='float64')
+            price = performance_data['price'].to_numpy(dtype='float64')
+            valid = np.isfinite(purchase_price) & np.isfinite(price) & (purchase_price != 0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                performance_data['performance'] = np.where(
+                    valid,
+                    np.round((price - purchase_price) / purchase_price * 100.0, 2),
+                    np.nan
+                )
 
             return performance_data.sort_values(
                 by='performance',
@@ -116,45 +127,54 @@ class PerformanceCalculator:
 
     def _print_performance_summary(self, performance_data):
         """Print performance summary"""
-        print("\n📊 Performance Summary")
-        print("=" * 120)
-
-        # Print header
-        print(f"{'Symbol':<12} {'Portfolio':<12} {'Purchase':>12} {'Current':>12} "
-              f"{'Performance':>12} {'Quantity':>10} {'Value':>15} {'P/L':>15}")
-        print("-" * 120)
-
-        # Print each row
-        for _, row in performance_data.iterrows():
-            total_qty = row['purchaseQty'] + row['additionalQty']
-            current_value = row['price'] * total_qty
-            purchase_value = row['purchasePrice'] * total_qty
-            profit_loss = current_value - purchase_value
-
-            print(
-                f"{row['stockSymbol']:<12} "
-                f"{row['portfolioName']:<12} "
-                f"₹{row['purchasePrice']:>10,.2f} "
-                f"₹{row['price']:>10,.2f} "
-                f"{row['performance']:>10.2f}% "
-                f"{total_qty:>10.0f} "
-                f"₹{current_value:>13,.2f} "
-                f"{'📈' if profit_loss > 0 else '📉'} ₹{
-                    abs(profit_loss):>10,.2f}"
+        total_qty = performance_data['totalQuantity']
+        current_value = performance_data['price'] * total_qty
+        purchase_value = performance_data['purchasePrice'] * total_qty
+        profit_loss = current_value - purchase_value
+
+        lines = [
+            "\n📊 Performance Summary",
+            "=" * 120,
+            f"{'Symbol':<12} {'Portfolio':<12} {'Purchase':>12} {'Current':>12} "
+            f"{'Performance':>12} {'Quantity':>10} {'Value':>15} {'P/L':>15}",
+            "-" * 120
+        ]
+
+        # Format each row from precomputed columns
+        lines.extend(
+            f"{symbol:<12} "
+            f"{portfolio:<12} "
+            f"₹{purchase:>10,.2f} "
+            f"₹{price:>10,.2f} "
+            f"{performance:>10.2f}% "
+            f"{qty:>10.0f} "
+            f"₹{value:>13,.2f} "
+            f"{'📈' if pl > 0 else '📉'} ₹{abs(pl):>10,.2f}"
+            for symbol, portfolio, purchase, price, performance, qty, value, pl in zip(
+                performance_data['stockSymbol'].to_numpy(),
+                performance_data['portfolioName'].to_numpy(),
+                performance_data['purchasePrice'].to_numpy(),
+                performance_data['price'].to_numpy(),
+                performance_data['performance'].to_numpy(),
+                total_qty.to_numpy(),
+                current_value.to_numpy(),
+                profit_loss.to_numpy()
             )
+        )
+
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
 
-        self._print_summary_statistics(performance_data)
+        self._print_summary_statistics(performance_data, current_value, purchase_value)
 
-    def _print_summary_statistics(self, performance_data):
+    def _print_summary_statistics(self, performance_data, current_value, purchase_value):
         """Print summary statistics"""
         print("\nSummary Statistics:")
         print("-" * 50)
 
         avg_performance = performance_data['performance'].mean()
-        total_value = (performance_data['price'] *
-                       (performance_data['purchaseQty'] + performance_data['additionalQty'])).sum()
-        total_cost = (performance_data['purchasePrice'] *
-                      (performance_data['purchaseQty'] + performance_data['additionalQty'])).sum()
+        total_value = current_value.sum()
+        total_cost = purchase_value.sum()
         total_pl = total_value - total_cost
 
         print(f"Average Performance: {avg_performance:.2f}%")
@@ -1,9 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 from agents.portfolio_fetcher import PortfolioFetcher
 from agents.price_fetcher import PriceFetcher
 from agents.performance_calculator import PerformanceCalculator
 from agents.notification_sender import NotificationSender
+from agents.db import POOL_SIZE, MAX_OVERFLOW
 from config import FEATURE_FLAGS
-from datetime import date, datetime
 import pandas as pd
 from agents.logger import setup_logger
 
@@ -12,46 +13,51 @@ class PortfolioManager:
     def __init__(self):
         self.portfolio_fetcher = PortfolioFetcher()
         self.price_fetcher = PriceFetcher()
-        self.performance_calculator = PerformanceCalculator()
+        self.performance_calculator = PerformanceCalculator(
+            portfolio_fetcher=self.portfolio_fetcher,
+            price_fetcher=self.price_fetcher
+        )
         self.notification_sender = NotificationSender()
 
     def run(self):
         try:
             # Get portfolio data
             portfolio_data = self.portfolio_fetcher.get_portfolio_data()
-            stock_symbols = self.portfolio_fetcher.get_unique_symbols()
+            stock_symbols = portfolio_data['stockSymbol'].unique().tolist()
 
-            # Fetch and update prices
-            prices = self.price_fetcher.fetch_prices(stock_symbols)
-            self.portfolio_fetcher.update_stock_prices(prices)
+            # Fetch prices; PriceFetcher stores newly fetched ones itself
+            prices = self.price_fetcher.fetch_prices(stock_symbols) or {}
+            current_prices = pd.DataFrame(
+                [
+                    {
+                        'stockSymbol': symbol,
+                        'price': data['price'],
+                        'priceDate': data['priceDate'],
+                        'source': data['source']
+                    }
+                    for symbol, data in prices.items()
+                ],
+                columns=['stockSymbol', 'price', 'priceDate', 'source']
+            )
+
+            # Fall back to the last stored prices for symbols that were not fetched
+            if len(prices) < len(stock_symbols):
+                stored_prices = self.portfolio_fetcher.get_current_prices()
+                if not stored_prices.empty:
+                    stored_prices = stored_prices[~stored_prices['stockSymbol'].isin(list(prices))]
+                    current_prices = pd.concat([current_prices, stored_prices], ignore_index=True)
 
             # Calculate performance
             performance_data = self.performance_calculator.calculate_performance(
                 portfolio_data,
-                self.portfolio_fetcher.get_current_prices()
+                current_prices
             )
 
             # Display results
             if performance_data is not None and not performance_data.empty:
                 print("\n📈 Portfolio Performance:")
                 
-                # Format the display data
-                display_data = performance_data.copy()
-                
-                # Format numeric columns
-                pd.set_option('display.float_format', lambda x: '%.2f' % x)
-                
-                # Convert price_age_days to string representation
-                display_data['price_age'] = display_data['price_age_days'].apply(
-                    lambda x: f"{int(x)} days" if pd.notnull(x) else "N/A"
-                )
-
-                # Format dates as strings
-                display_data['priceDate'] = display_data['priceDate'].apply(
-                    lambda x: x.strftime('%Y-%m-%d') if isinstance(x, (date, datetime)) else str(x)
-                )
-
-                print(display_data[[
+                display = performance_data[[
                     'stockSymbol', 
                     'owner', 
                     'portfolioName',
@@ -60,15 +66,26 @@ class PortfolioManager:
                     'performance',
                     'source',
                     'priceDate',
-                    'price_age'
-                ]].to_string())
+                    'price_age_days'
+                ]]
+                # to_string skips formatters and na_rep for NaT in object columns, so
+                # render dates as text up front
+                display = display.assign(
+                    priceDate=pd.to_datetime(display['priceDate']).dt.strftime('%Y-%m-%d').fillna('N/A')
+                )
+                print(display.to_string(index=False, na_rep='N/A', formatters={
+                    'purchasePrice': '{:.2f}'.format,
+                    'price': '{:.2f}'.format,
+                    'performance': '{:.2f}'.format,
+                    'price_age_days': lambda x: f"{int(x)} days"
+                }))
 
                 # Add warning for old prices
                 old_prices = performance_data[performance_data['price_age_days'] > 1]
                 if not old_prices.empty:
                     print("\n⚠️ Warning: Some prices are more than 1 day old:")
-                    for _, row in old_prices.iterrows():
-                        print(f"   {row['stockSymbol']}: {row['price_age']}")
+                    for symbol, age in zip(old_prices['stockSymbol'], old_prices['price_age_days']):
+                        print(f"   {symbol}: {int(age)} days")
 
             # Send notifications only if enabled
             if FEATURE_FLAGS['enable_email_notifications']:
@@ -81,6 +98,18 @@ class PortfolioManager:
             print(f"\n❌ Portfolio Manager Error:")
             print(f"   {str(e)}")
 
+    def run_all_owners(self, owners, max_workers=8):
+        """Calculate performance for several owners concurrently, using at most one pooled connection per worker"""
+        owners = list(owners)
+        # Workers share the engine pool, so never run more than it can hand out
+        max_workers = min(max_workers, POOL_SIZE + MAX_OVERFLOW)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                self.performance_calculator.calculate_performance_for_owner,
+                owners
+            )
+            return dict(zip(owners, results))
+
 
 if __name__ == "__main__":
     manager = PortfolioManager()
@@ -1,20 +1,27 @@
+import sys
 from datetime import datetime
-import pandas as pd
 from agents.portfolio_fetcher import PortfolioFetcher
 from agents.price_fetcher import PriceFetcher
 from agents.logger import setup_logger
 from sqlalchemy import text
 
+# One row per portfolio and valuation date; re-running a day overwrites its value
+_UPSERT_VALUE_SQL = text("""
+    INSERT INTO portfoliovalue (portfolioName, owner, value, valuationDate)
+    VALUES (:portfolioName, :owner, :value, :valuationDate)
+    ON DUPLICATE KEY UPDATE value = VALUES(value)
+""")
+
 
 class PortfolioValuator:
-    def __init__(self):
-        self.portfolio_fetcher = PortfolioFetcher()
-        self.price_fetcher = PriceFetcher()
+    def __init__(self, portfolio_fetcher=None, price_fetcher=None):
+        self.portfolio_fetcher = portfolio_fetcher or PortfolioFetcher()
+        self.price_fetcher = price_fetcher or PriceFetcher()
         self.engine = self.portfolio_fetcher.engine
         self.logger = setup_logger(__name__)
 
-    def calculate_portfolio_value(self, owner=None):
-        """Calculate current portfolio value for a specific owner"""
+    def calculate_portfolio_value(self, owner=None, prices_df=None):
+        """Calculate current portfolio value for a specific owner, optionally from prefetched prices"""
         try:
             if not owner:
                 self.logger.error("Owner parameter is required")
@@ -26,7 +33,7 @@ class PortfolioValuator:
             print("=" * 50)
 
             # Get portfolio data and prices
-            portfolio_data, prices_df = self._fetch_data(owner)
+            portfolio_data, prices_df = self._fetch_data(owner, prices_df)
             if portfolio_data is None or prices_df is None:
                 return None
 
@@ -43,36 +50,28 @@ class PortfolioValuator:
             self.logger.error(f"Error calculating portfolio value: {str(e)}", exc_info=True)
             return None
 
-    def _fetch_data(self, owner):
-        """Fetch required portfolio and price data"""
+    def _fetch_data(self, owner, prices_df=None):
+        """Fetch required portfolio data, and price data unless already supplied"""
         try:
-            # Get portfolio data
-            portfolio_data = self.portfolio_fetcher.get_portfolio_data()
-            if portfolio_data.empty:
-                self.logger.warning("No portfolio data found")
-                return None, None
-
-            # Filter for owner
-            portfolio_data = portfolio_data[portfolio_data['owner'] == owner]
+            # Get portfolio data for owner
+            portfolio_data = self.portfolio_fetcher.get_portfolio_data(owner)
             if portfolio_data.empty:
                 self.logger.warning(f"No portfolio data found for owner: {owner}")
                 return None, None
 
             # Get current prices
             symbols = portfolio_data['stockSymbol'].unique()
-            self.logger.debug(f"Fetching prices for symbols: {symbols}")
-            prices = self.price_fetcher.fetch_prices(symbols)
-            
-            if not prices:
+            if prices_df is None:
+                self.logger.debug(f"Fetching prices for symbols: {symbols}")
+                prices_df = self.price_fetcher.fetch_prices_df(symbols)
+            else:
+                # Supplied prices are shared with other agents; work on our own copy
+                prices_df = prices_df.copy()
+
+            if prices_df.empty:
                 self.logger.warning("No price data available")
                 return None, None
 
-            # Convert prices dictionary to DataFrame
-            prices_df = pd.DataFrame([
-                {'stockSymbol': symbol, 'price': data['price']} 
-                for symbol, data in prices.items()
-            ])
-
             return portfolio_data, prices_df
 
         except Exception as e:
@@ -85,28 +84,24 @@ class PortfolioValuator:
             valuation_date = datetime.now().date()
             
             # Merge portfolio data with prices
-            merged_data = pd.merge(
-                portfolio_data,
-                prices_df,
-                on='stockSymbol',
-                how='left'
-            )
-
-            # Convert quantity columns to numeric
-            merged_data['purchaseQty'] = pd.to_numeric(merged_data['purchaseQty'], errors='coerce')
-            merged_data['additionalQty'] = pd.to_numeric(merged_data['additionalQty'], errors='coerce').fillna(0)
-
-            # Group by portfolio and calculate total values
-            portfolio_values = []
-            for (portfolio_name, owner), group in merged_data.groupby(['portfolioName', 'owner']):
-                total_value = (group['price'] * (group['purchaseQty'] + group['additionalQty'])).sum()
-                
-                portfolio_values.append({
-                    'portfolioName': portfolio_name,
-                    'owner': owner,
-                    'value': round(total_value, 2),
+            prices_df['stockSymbol'] = prices_df['stockSymbol'].astype(portfolio_data['stockSymbol'].dtype)
+            merged_data = portfolio_data.merge(prices_df, on='stockSymbol', how='inner')
+
+            # Value every holding, then total per portfolio in one groupby
+            merged_data['value'] = merged_data['price'].astype('float64') * merged_data['totalQuantity']
+            totals = merged_data.groupby(
+                ['portfolioName', 'owner'], sort=False, observed=True, as_index=False
+            )['value'].sum().round(2)
+
+            portfolio_values = [
+                {
+                    'portfolioName': row.portfolioName,
+                    'owner': row.owner,
+                    'value': float(row.value),
                     'valuationDate': valuation_date
-                })
+                }
+                for row in totals.itertuples(index=False)
+            ]
 
             return portfolio_values
 
@@ -117,15 +112,10 @@ class PortfolioValuator:
     def _save_portfolio_values(self, portfolio_values):
         """Save portfolio values to database"""
         try:
-            query = """
-                REPLACE INTO portfoliovalue (portfolioName, owner, value, valuationDate)
-                VALUES (:portfolioName, :owner, :value, :valuationDate)
-            """
-            
-            with self.engine.connect() as connection:
-                connection.execute(text(query), portfolio_values)
-                connection.commit()
-                self.logger.info("Portfolio values updated successfully")
+            # One executemany inside a single transaction
+            with self.engine.begin() as connection:
+                connection.execute(_UPSERT_VALUE_SQL, portfolio_values)
+            self.logger.info("Portfolio values updated successfully")
 
         except Exception as e:
             self.logger.error(f"Error saving portfolio values: {str(e)}")
@@ -133,20 +123,23 @@ class PortfolioValuator:
 
     def _print_portfolio_summary(self, portfolio_values):
         """Print portfolio valuation summary"""
-        print("\n📊 Portfolio Valuation Summary")
-        print("=" * 80)
-        print(f"{'Portfolio':<15} {'Owner':<15} {'Value':>20} {'Date':>15}")
-        print("-" * 80)
-
-        total_value = 0
-        for val in portfolio_values:
-            print(
-                f"{val['portfolioName']:<15} "
-                f"{val['owner']:<15} "
-                f"₹{val['value']:>18,.2f} "
-                f"{val['valuationDate'].strftime('%Y-%m-%d'):>15}"
-            )
-            total_value += val['value']
-
-        print("-" * 80)
-        print(f"{'Total Value:':<31} ₹{total_value:>18,.2f}")
+        lines = [
+            "\n📊 Portfolio Valuation Summary",
+            "=" * 80,
+            f"{'Portfolio':<15} {'Owner':<15} {'Value':>20} {'Date':>15}",
+            "-" * 80
+        ]
+        lines.extend(
+            f"{val['portfolioName']:<15} "
+            f"{val['owner']:<15} "
+            f"₹{val['value']:>18,.2f} "
+            f"{val['valuationDate'].strftime('%Y-%m-%d'):>15}"
+            for val in portfolio_values
+        )
+
+        total_value = sum(val['value'] for val in portfolio_values)
+        lines.append("-" * 80)
+        lines.append(f"{'Total Value:':<31} ₹{total_value:>18,.2f}")
+
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
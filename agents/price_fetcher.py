@@ -1,125 +1,390 @@
-import yfinance as yf
-import requests
-from bs4 import BeautifulSoup
+import httpx
+import importlib.util
+import asyncio
+import re
+import sys
+import threading
 import time
-from config import PRICE_SOURCES, FEATURE_FLAGS, PRICE_VALIDATION, DB_CONFIG
+import numpy as np
+import pandas as pd
+from config import PRICE_SOURCES, PRICE_CACHE, FEATURE_FLAGS, PRICE_VALIDATION, BATCH_SIZE
 from datetime import datetime
-from sqlalchemy import create_engine, text
-from agents.logger import setup_logger
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects.mysql import insert
+from agents.db import ENGINE, STOCKPRICE
+from agents.logger import setup_logger, OUTPUT_LOCK
+
+# Google Finance renders the quote as <div class="YMlKec fxKbKc">₹1,234.50</div>
+_GOOGLE_PRICE_RE = re.compile(rb'class="YMlKec fxKbKc"[^>]*>\s*(?:\xe2\x82\xb9)?\s*([0-9,.]+)')
+
+# HTTP/2 needs the optional h2 package (httpx[http2]); fall back to HTTP/1.1 without it
+_HTTP2 = importlib.util.find_spec('h2') is not None
+
+
+class _TokenBucket:
+    """Thread-safe token bucket shared by every event loop in the process"""
+
+    def __init__(self, rate):
+        self._rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the seconds to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._rate, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            # A negative balance queues callers behind earlier reservations
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self._rate
+
+
+# One request budget for Google Finance across all fetchers and threads
+_GOOGLE_BUCKET = _TokenBucket(PRICE_SOURCES['google_finance']['rate_limit'])
+
+# Transient responses worth retrying with backoff
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Prices already stored for a given date; the symbol list is expanded into IN (...)
+_TODAYS_PRICES_SQL = text("""
+    SELECT stockSymbol, price, source, priceDate
+    FROM stockprice
+    WHERE priceDate = :price_date AND stockSymbol IN :symbols
+""").bindparams(bindparam('symbols', expanding=True))
 
 class PriceFetcher:
+    # Shared by every instance so separate agents reuse fresh prices
+    _price_cache = {}  # symbol -> (price data, fetched_at)
+    _google_validators = {}  # symbol -> (conditional request headers, last parsed price)
+
     def __init__(self):
         self.logger = setup_logger(__name__)
-        self.engine = create_engine(
-            f"mysql+pymysql://{DB_CONFIG['user']}:{DB_CONFIG['password']}@"
-            f"{DB_CONFIG['host']}/{DB_CONFIG['database']}"
-        )
+        self.engine = ENGINE
         self.sources = ['yahoo', 'google']
+        self._cache_ttl = PRICE_CACHE['ttl_seconds']
+        self._reuse_stored = PRICE_CACHE['reuse_stored_today']
+        self._validate = FEATURE_FLAGS['validate_prices']
+        self._min_price = PRICE_VALIDATION['min_price']
+        self._max_price = PRICE_VALIDATION['max_price']
+        self._fallback = FEATURE_FLAGS['enable_fallback_sources']
+        self._google_retries = PRICE_SOURCES['google_finance']['retry_count']
+        self._google_retry_delay = PRICE_SOURCES['google_finance']['retry_delay']
+        self._url_cache = {}  # symbol -> Google Finance quote URL
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
 
     def fetch_prices(self, symbols):
         """Fetch current prices for given symbols"""
+        # Serve recently fetched symbols from the cache
+        now = time.monotonic()
+        prices = {}
+        pending = []
+        for symbol in symbols:
+            cached = self._price_cache.get(symbol)
+            if cached and now - cached[1] < self._cache_ttl:
+                prices[symbol] = cached[0]
+            else:
+                pending.append(symbol)
+
+        # Optionally skip symbols that already have today's price stored
+        if pending and self._reuse_stored:
+            pending, stored = self._filter_stale(pending)
+            prices.update(stored)
+
+        if not pending:
+            self.logger.debug(f"Using cached prices for {len(prices)} symbols")
+            return prices
+
         try:
             self.logger.info("\n📊 Fetching Stock Prices...")
-            print("=" * 50)
-            
-            prices = {}
-            for symbol in symbols:
-                price = None
-                source_used = None
-
-                # Try Yahoo Finance first
-                price, source_used = self._fetch_price_yahoo(symbol)
-                
-                # If Yahoo fails, try Google Finance
-                if price is None:
-                    price, source_used = self._fetch_price_google(symbol)
-                
-                if price:
-                    prices[symbol] = {
-                        'price': price,
-                        'source': source_used
-                    }
-                    print(f"✅ Fetched {symbol}: ₹{price:,.2f} from {source_used}")
-                else:
-                    print(f"❌ Failed to fetch price for {symbol} from all sources")
-            
-            if prices:
-                print(f"✅ Successfully fetched {len(prices)} stock prices")
-                self._update_prices_in_db(prices)
+
+            price_date = datetime.now().date()
+            lines = ["=" * 50]
+
+            # Fetch every symbol from Yahoo Finance in one batched request
+            results = self._fetch_prices_yahoo_bulk(pending)
+            missing = [symbol for symbol, (price, _) in results.items() if price is None]
+            fetched = self._collect_prices(
+                {symbol: result for symbol, result in results.items() if result[0] is not None},
+                price_date,
+                lines
+            )
+
+            if missing and self._fallback:
+                # Store the Yahoo prices while the Google Finance fallback is in flight
+                fallback = asyncio.run(self._fetch_fallback(missing, fetched))
+                fallback_fetched = self._collect_prices(fallback, price_date, lines)
+                if fallback_fetched:
+                    self._store_prices(fallback_fetched)
+                fetched.update(fallback_fetched)
+            else:
+                self._collect_prices({symbol: (None, None) for symbol in missing}, price_date, lines)
+                if fetched:
+                    self._store_prices(fetched)
+
+            if fetched:
+                lines.append(f"✅ Successfully fetched {len(fetched)} stock prices")
+                fetched_at = time.monotonic()
+                for symbol, data in fetched.items():
+                    self._price_cache[symbol] = (data, fetched_at)
             else:
-                print("❌ No prices could be fetched")
+                lines.append("❌ No prices could be fetched")
+
+            # Emit the buffered status lines in one write, atomic across threads
+            with OUTPUT_LOCK:
+                sys.stdout.write("\n".join(lines) + "\n")
             
+            prices.update(fetched)
             return prices
 
         except Exception as e:
             self.logger.error(f"Error fetching prices: {str(e)}")
             return None
 
-    def _fetch_price_yahoo(self, symbol):
-        """Fetch price from Yahoo Finance"""
+    def _collect_prices(self, results, price_date, lines):
+        """Build price entries from (price, source) results, appending a status line per symbol"""
+        values = np.fromiter(
+            (np.nan if price is None else price for price, _ in results.values()),
+            dtype='float64',
+            count=len(results)
+        )
+
+        # Validate every price against the configured bounds in one pass
+        found = ~np.isnan(values) & (values != 0)
+        valid = found
+        if self._validate:
+            valid = found & (values >= self._min_price) & (values <= self._max_price)
+
+        fetched = {}
+        for (symbol, (price, source_used)), is_found, is_valid in zip(results.items(), found, valid):
+            if is_valid:
+                fetched[symbol] = {
+                    'price': price,
+                    'source': source_used,
+                    'priceDate': price_date
+                }
+                lines.append(f"✅ Fetched {symbol}: ₹{price:,.2f} from {source_used}")
+            elif is_found:
+                lines.append(f"⚠️ Discarded out-of-range price for {symbol}: ₹{price:,.2f}")
+            else:
+                lines.append(f"❌ Failed to fetch price for {symbol} from all sources")
+        return fetched
+
+    async def _fetch_fallback(self, symbols, fetched):
+        """Fetch fallback prices for symbols while already fetched prices are written to the database"""
+        tasks = [self._fetch_all(symbols)]
+        if fetched:
+            tasks.append(asyncio.to_thread(self._store_prices, fetched))
+        # _store_prices never raises; a failed fallback leaves only its own symbols unpriced
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        if isinstance(results[0], BaseException):
+            self.logger.error(f"Error fetching fallback prices: {str(results[0])}")
+            return {symbol: (None, None) for symbol in symbols}
+        return results[0]
+
+    def _filter_stale(self, symbols):
+        """Split symbols into those needing a fetch and today's prices already in the database"""
         try:
-            stock = yf.Ticker(symbol)
-            hist = stock.history(period="1d")
-            if not hist.empty:
-                return float(hist['Close'].iloc[-1]), "yahoo"
-            return None, None
+            with self.engine.connect() as conn:
+                # Today's date from Python, matching the priceDate written on fetch
+                rows = conn.execute(
+                    _TODAYS_PRICES_SQL,
+                    {'price_date': datetime.now().date(), 'symbols': list(symbols)}
+                ).all()
+        except Exception as e:
+            self.logger.error(f"Error reading today's prices from database: {str(e)}")
+            return list(symbols), {}
+
+        fetched_at = time.monotonic()
+        stored = {}
+        for symbol, price, source, price_date in rows:
+            stored[symbol] = {'price': float(price), 'source': source, 'priceDate': price_date}
+            self._price_cache[symbol] = (stored[symbol], fetched_at)
+
+        return [symbol for symbol in symbols if symbol not in stored], stored
+
+    def fetch_prices_df(self, symbols):
+        """Fetch current prices for given symbols as a DataFrame"""
+        prices = self.fetch_prices(symbols) or {}
+        return pd.DataFrame({
+            'stockSymbol': list(prices),
+            'price': np.fromiter(
+                (data['price'] for data in prices.values()),
+                dtype='float64',
+                count=len(prices)
+            ),
+            'source': [data['source'] for data in prices.values()],
+            'priceDate': [data['priceDate'] for data in prices.values()]
+        })
+
+    def _fetch_prices_yahoo_bulk(self, symbols):
+        """Fetch prices for all symbols from Yahoo Finance in one batched download"""
+        batch = self._download_yahoo(symbols)
+
+        # Take every symbol's last close in one pass over the (ticker, field) columns
+        last = {}
+        if batch is not None and not batch.empty and isinstance(batch.columns, pd.MultiIndex):
+            closes = batch.xs('Close', axis=1, level=1)
+            last = closes.ffill().iloc[-1].dropna().to_dict()
+
+        # yfinance keys its columns by upper-cased ticker; map back to the caller's symbols
+        return {
+            symbol: (float(last[symbol.upper()]), "yahoo") if symbol.upper() in last else (None, None)
+            for symbol in symbols
+        }
 
+    def _download_yahoo(self, symbols):
+        """Download the latest daily bars for all symbols in one batched call"""
+        # Imported on first use; yfinance is slow to import and only needed here
+        import yfinance as yf
+
+        try:
+            return yf.download(
+                tickers=list(symbols),
+                period='1d',
+                interval='1d',
+                group_by='ticker',
+                threads=True,
+                progress=False,
+                auto_adjust=False
+            )
         except Exception as e:
-            self.logger.error(f"Error fetching from Yahoo Finance for {symbol}: {str(e)}")
-            return None, None
+            self.logger.error(f"Error downloading batch from Yahoo Finance: {str(e)}")
+            return None
+
+    async def _fetch_all(self, symbols):
+        """Fetch Google Finance prices for symbols concurrently over one shared HTTP client"""
+        # HTTP/2 multiplexes every symbol's request over one TLS connection
+        async with httpx.AsyncClient(
+            http2=_HTTP2,
+            headers=self.headers,
+            timeout=5.0,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+        ) as client:
+            tasks = [self._fetch_price_google_async(client, symbol) for symbol in symbols]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
 
-    def _fetch_price_google(self, symbol):
+        return {
+            symbol: (None, None) if isinstance(result, BaseException) else result
+            for symbol, result in zip(symbols, results)
+        }
+
+    async def _fetch_price_google_async(self, client, symbol):
         """Fetch price from Google Finance"""
-        try:
-            google_symbol = f"NSE:{symbol.replace('.NS', '')}"
-            url = f"https://www.google.com/finance/quote/{google_symbol}"
-            
-            response = requests.get(url, headers=self.headers)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-                price_div = soup.find('div', {'class': 'YMlKec fxKbKc'})
-                
-                if price_div:
-                    price_text = price_div.text.replace('₹', '').replace(',', '')
-                    return float(price_text), "google"
-            
-            return None, None
+        url = self._url_for(symbol)
 
-        except Exception as e:
-            self.logger.error(f"Error fetching from Google Finance for {symbol}: {str(e)}")
-            return None, None
+        for attempt in range(self._google_retries + 1):
+            try:
+                # Revalidate the last page so an unchanged quote costs no body or parse
+                validator = self._google_validators.get(symbol)
+                headers = validator[0] if validator else None
+
+                # Only wait when the shared budget is nearly spent
+                delay = _GOOGLE_BUCKET.reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                response = await client.get(url, headers=headers)
+                if response.status_code == 304 and validator:
+                    return validator[1], "google"
+                if response.status_code == 200:
+                    price = self._parse_google_price(response.content)
+                    if price is not None:
+                        self._remember_validators(symbol, response.headers, price)
+                        return price, "google"
+                    return None, None
+                if response.status_code not in _RETRY_STATUSES:
+                    return None, None
+
+            except httpx.TransportError as e:
+                if attempt == self._google_retries:
+                    self.logger.error(f"Error fetching from Google Finance for {symbol}: {str(e)}")
+                    return None, None
+            except Exception as e:
+                self.logger.error(f"Error fetching from Google Finance for {symbol}: {str(e)}")
+                return None, None
+
+            if attempt < self._google_retries:
+                # Exponential backoff before the next attempt
+                await asyncio.sleep(self._google_retry_delay * 2 ** attempt)
+
+        return None, None
+
+    def _url_for(self, symbol):
+        """Return the Google Finance quote URL for symbol, built once per symbol"""
+        url = self._url_cache.get(symbol)
+        if url is None:
+            url = f"https://www.google.com/finance/quote/NSE:{symbol.removesuffix('.NS')}"
+            self._url_cache[symbol] = url
+        return url
+
+    def _remember_validators(self, symbol, response_headers, price):
+        """Store ETag/Last-Modified from a Google response for the next conditional GET"""
+        headers = {}
+        if 'ETag' in response_headers:
+            headers['If-None-Match'] = response_headers['ETag']
+        if 'Last-Modified' in response_headers:
+            headers['If-Modified-Since'] = response_headers['Last-Modified']
+        if headers:
+            self._google_validators[symbol] = (headers, price)
+        else:
+            self._google_validators.pop(symbol, None)
+
+    def _parse_google_price(self, content):
+        """Extract the quote price from a Google Finance page"""
+        # Match the price directly and only build a DOM if the markup changed
+        match = _GOOGLE_PRICE_RE.search(content)
+        if match:
+            return float(match.group(1).replace(b',', b'').decode())
+
+        from selectolax.lexbor import LexborHTMLParser
+
+        price_div = LexborHTMLParser(content.decode('utf-8', 'replace')).css_first('div.YMlKec.fxKbKc')
+        if price_div:
+            price_text = price_div.text().replace('₹', '').replace(',', '').strip()
+            return float(price_text)
+        return None
+
+    def _store_prices(self, prices):
+        """Write prices to the database, logging instead of raising so fetched prices are kept"""
+        try:
+            self._update_prices_in_db(prices)
+            return True
+        except Exception:
+            self.logger.warning(f"Fetched prices for {len(prices)} stocks could not be stored")
+            return False
 
     def _update_prices_in_db(self, prices):
         """Update stock prices in database"""
         try:
-            query = """
-                REPLACE INTO stockprice (stockSymbol, price, priceDate, source)
-                VALUES (:stockSymbol, :price, :priceDate, :source)
-            """
-            
-            current_date = datetime.now().date()
+            stmt = insert(STOCKPRICE)
+            stmt = stmt.on_duplicate_key_update(
+                price=stmt.inserted.price,
+                priceDate=stmt.inserted.priceDate,
+                source=stmt.inserted.source
+            )
+
             price_data = [
                 {
                     'stockSymbol': symbol,
                     'price': data['price'],
-                    'priceDate': current_date,
+                    'priceDate': data['priceDate'],
                     'source': data['source']
                 }
                 for symbol, data in prices.items()
             ]
 
-            with self.engine.connect() as connection:
-                connection.execute(text(query), price_data)
-                connection.commit()
-                self.logger.info(f"Updated prices for {len(price_data)} stocks in database")
+            # One pooled connection and transaction, committed on exit; BATCH_SIZE
+            # bounds the rows per executemany, which pymysql further splits into
+            # multi-row INSERTs of at most max_stmt_length bytes
+            with self.engine.begin() as conn:
+                for start in range(0, len(price_data), BATCH_SIZE):
+                    conn.execute(stmt, price_data[start:start + BATCH_SIZE])
+            self.logger.info(f"Updated prices for {len(price_data)} stocks in database")
 
         except Exception as e:
             self.logger.error(f"Error updating prices in database: {str(e)}")
             raise
-
-    def _add_delay(self):
-        """Add delay between requests to avoid rate limiting"""
-        time.sleep(1)
@@ -33,10 +33,18 @@ PRICE_SOURCES = {
         'enabled': True,
         'priority': 2,
         'retry_count': 2,
-        'retry_delay': 1
+        'retry_delay': 1,
+        'rate_limit': 5  # requests per second
     }
 }
 
+# Price Cache Configuration
+PRICE_CACHE = {
+    'ttl_seconds': int(os.getenv('PRICE_CACHE_TTL', 60)),
+    # Reuse prices already stored for today instead of refreshing them intraday
+    'reuse_stored_today': os.getenv('PRICE_REUSE_STORED_TODAY', 'false').lower() == 'true'
+}
+
 # Feature Flags
 FEATURE_FLAGS = {
     'enable_fallback_sources': True,
@@ -66,3 +74,6 @@ DB_CONFIG = {
     'host': os.getenv('DB_HOST'),
     'database': os.getenv('DB_NAME')
 }
+
+# Rows per executemany call for bulk database writes
+BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 10000))
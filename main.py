@@ -1,6 +1,8 @@
 from agents.portfolio_valuator import PortfolioValuator
 from agents.performance_calculator import PerformanceCalculator
 from agents.notification_sender import NotificationSender
+from agents.portfolio_fetcher import PortfolioFetcher
+from agents.price_fetcher import PriceFetcher
 import argparse
 
 def main():
@@ -13,15 +15,26 @@ def main():
 
     args = parser.parse_args()
 
+    # Share one set of fetchers between the valuator and the calculator
+    portfolio_fetcher = PortfolioFetcher()
+    price_fetcher = PriceFetcher()
+
+    # Fetch prices once when both analyses need them
+    prices_df = None
+    if args.action == 'both':
+        holdings = portfolio_fetcher.get_portfolio_data(args.owner)
+        if not holdings.empty:
+            prices_df = price_fetcher.fetch_prices_df(holdings['stockSymbol'].unique())
+
     if args.action in ['value', 'both']:
         # Calculate portfolio value
-        valuator = PortfolioValuator()
-        portfolio_values = valuator.calculate_portfolio_value(args.owner)
+        valuator = PortfolioValuator(portfolio_fetcher, price_fetcher)
+        valuator.calculate_portfolio_value(args.owner, prices_df=prices_df)
 
     if args.action in ['performance', 'both']:
         # Calculate performance
-        calculator = PerformanceCalculator()
-        performance_data = calculator.calculate_performance_for_owner(args.owner)
+        calculator = PerformanceCalculator(portfolio_fetcher, price_fetcher)
+        performance_data = calculator.calculate_performance_for_owner(args.owner, prices_df=prices_df)
         
         # Send notification if performance was calculated
         if performance_data is not None: